@@ -34,40 +34,178 @@ Comments and/or patches are always welcome.
 __author__ = "Filip Salomonsson <filip.salomonsson@gmail.com>"
 __version__ = "1.0"
 
+import collections.abc
+import datetime
+import decimal
+import functools
+import operator
+import queue
+import re
+import sys
+import threading
+import types
+from typing import List, Sequence, Tuple, Union, get_type_hints
+
 
 INDENT = "  "
 
+# Number of rows written at a time by XMLWriter.rows()
+_ROWS_PER_CHUNK = 1024
+
 
 def escape_attribute(value, encoding):
     """Escape an attribute value using the given encoding."""
+    return _escape_attribute_text(value).encode(encoding, "xmlcharrefreplace")
+
+
+def _escape_attribute_text(value):
+    """Escape an attribute value, without encoding it."""
     if "&" in value:
         value = value.replace("&", "&amp;")
     if "<" in value:
         value = value.replace("<", "&lt;")
     if '"' in value:
         value = value.replace('"', "&quot;")
-    return value.encode(encoding, "xmlcharrefreplace")
+    return value
 
 
 def escape_cdata(data, encoding):
     """Escape character data using the given encoding."""
+    return _escape_cdata_text(data).encode(encoding, "xmlcharrefreplace")
+
+
+def _escape_cdata_text(data):
+    """Escape character data, without encoding it."""
     if "&" in data:
         data = data.replace("&", "&amp;")
     if "<" in data:
         data = data.replace("<", "&lt;")
     if ">" in data:
         data = data.replace(">", "&gt;")
-    return data.encode(encoding, "xmlcharrefreplace")
+    return data
+
+
+def _format_column(values, config, attribute):
+    """Convert a sequence of values to a list of formatted and escaped
+    strings, leaving `None` values as they are.
+
+    Columns of strings are first checked for markup characters in one
+    go, so that they are only escaped value by value if needed. Other
+    values are formatted using the formatters of `config` (see
+    `WriterConfig`), with one formatter lookup per type.
+    """
+    types = set(map(type, values))
+    types.discard(type(None))
+    if types == {str}:
+        if attribute:
+            escape, specials = _escape_attribute_text, '&<"'
+        else:
+            escape, specials = _escape_cdata_text, "&<>"
+        text = "".join([value for value in values if value is not None])
+        if not any(char in text for char in specials):
+            return values
+        return [value if value is None else escape(value) for value in values]
+    if len(types) == 1:
+        formatter = config._formatter(types.pop(), attribute)
+        return [value if value is None else formatter(value) for value in values]
+    formatter = config._formatter
+    return [
+        value if value is None else formatter(value.__class__, attribute)(value)
+        for value in values
+    ]
+
+
+def _format_bool(value):
+    return "true" if value else "false"
+
+
+def _isoformat(value):
+    return value.isoformat()
+
+
+# Formatters for types whose text representation never contains
+# markup characters, and so never needs escaping.
+_MARKUP_FREE_FORMATTERS = {
+    bool: _format_bool,
+    int: int.__repr__,
+    float: float.__repr__,
+    decimal.Decimal: decimal.Decimal.__str__,
+    datetime.datetime: _isoformat,
+    datetime.date: _isoformat,
+    datetime.time: _isoformat,
+}
 
 
 def _nssplitname(name):
-    if name is None:
-        return None
+    if name is None or isinstance(name, tuple):
+        return name
     if not name[0] == "{":
         return ("", name)
     return tuple(name[1:].split("}", 1))
 
 
+# Name and Char productions from the XML 1.0 (fifth edition) spec
+_NAME_START_CHARS = (
+    ":A-Z_a-z\xc0-\xd6\xd8-\xf6\xf8-\u02ff\u0370-\u037d\u037f-\u1fff"
+    "\u200c-\u200d\u2070-\u218f\u2c00-\u2fef\u3001-\ud7ff\uf900-\ufdcf"
+    "\ufdf0-\ufffd\U00010000-\U000effff"
+)
+_NAME_CHARS = _NAME_START_CHARS + "\\-.0-9\xb7\u0300-\u036f\u203f-\u2040"
+_is_name = re.compile("[%s][%s]*\\Z" % (_NAME_START_CHARS, _NAME_CHARS)).match
+_find_illegal_char = re.compile(
+    "[^\t\n\r\x20-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]"
+).search
+
+
+def _check_name(name):
+    """Raise an `XMLSyntaxError` unless `name` (in either {ns}tag or
+    ``(uri, tag)`` form) has a legal local name."""
+    if not name or (
+        isinstance(name, str) and name[0] == "{" and "}" not in name
+    ):
+        raise XMLSyntaxError("Invalid XML name: %r" % (name,))
+    uri, ncname = _nssplitname(name)
+    _check_chars(uri)
+    local = ncname
+    if not uri and local.startswith("xml:"):
+        # The xml prefix is always bound, and never needs declaring
+        local = local[len("xml:"):]
+    if ":" in local or not _is_name(local):
+        raise XMLSyntaxError("Invalid XML name: %r" % (ncname,))
+
+
+def _check_namespace(prefix, uri):
+    """Raise an `XMLSyntaxError` unless `prefix` (`None` or empty for
+    the default namespace) can be bound to `uri`."""
+    _check_chars(uri)
+    if not prefix:
+        return
+    if ":" in prefix or not _is_name(prefix):
+        raise XMLSyntaxError("Invalid namespace prefix: %r" % (prefix,))
+    if (
+        prefix == "xmlns"
+        or uri == _XMLNS_NAMESPACE
+        or (prefix == "xml") != (uri == _XML_NAMESPACE)
+    ):
+        raise XMLSyntaxError(
+            "Reserved namespace prefix or URI: %r, %r" % (prefix, uri)
+        )
+
+
+_XML_NAMESPACE = "http://www.w3.org/XML/1998/namespace"
+_XMLNS_NAMESPACE = "http://www.w3.org/2000/xmlns/"
+
+
+def _check_chars(data):
+    """Raise an `XMLSyntaxError` if `data` contains characters that
+    are not allowed in XML documents."""
+    match = _find_illegal_char(data)
+    if match:
+        raise XMLSyntaxError(
+            "Illegal XML character %r at position %d." % (match.group(), match.start())
+        )
+
+
 def _cname(name, nsmap, cnames):
     """Return a cname from its {ns}tag form."""
     if not isinstance(name, tuple):
@@ -75,13 +213,17 @@ def _cname(name, nsmap, cnames):
     if name in cnames:
         return cnames[name]
     uri, ncname = name
-    if not uri:
-        for uri in nsmap:
-            if not nsmap[uri]:
-                break
-        else:
-            uri = ""
-    prefix = nsmap.setdefault(uri, "ns" + str(len(nsmap) + 1))
+    if uri == _XML_NAMESPACE:
+        # Bound to xml by definition, whatever else is in nsmap
+        prefix = "xml"
+    else:
+        if not uri:
+            for uri in nsmap:
+                if not nsmap[uri]:
+                    break
+            else:
+                uri = ""
+        prefix = nsmap.setdefault(uri, "ns" + str(len(nsmap) + 1))
     if prefix:
         cname = prefix + ":" + ncname
     else:
@@ -90,6 +232,11 @@ def _cname(name, nsmap, cnames):
     return cname
 
 
+# Sort key for ``(name, cname, value)`` tuples. Names are only
+# duplicated in trusted mode, and values may not be comparable.
+_attribute_name = operator.itemgetter(0)
+
+
 def sorter_factory(attrib_order):
     """Return a function that sorts a list of (key, value) pairs.
 
@@ -111,16 +258,12 @@ def sorter_factory(attrib_order):
     def asort(pairs, tag):
         """Sort a list of ``(name, cname, value)`` tuples), using the
         custom sort order for the given `tag` name."""
-
-        def key(item):
-            """Return a sort key for a ``(name, cname, value)`` tuple."""
-            (ncname, cname, value) = item
-            if tag not in attrib_order:
-                return ncname
-            keys = attrib_order[tag]
-            return keys.get(ncname, keys[None]), ncname
-
-        pairs.sort(key=key)
+        keys = attrib_order.get(tag)
+        if keys is None:
+            pairs.sort(key=_attribute_name)
+            return
+        last = keys[None]
+        pairs.sort(key=lambda item: (keys.get(item[0], last), item[0]))
 
     return asort
 
@@ -132,13 +275,27 @@ def tostring(element, *args, **kwargs):
     `element` is an Element instance. All additional positional and
     keyword arguments are passed on to the underlying `XMLWriter`.
 
+    Instead of the usual options, a `WriterConfig` can be given as
+    the `config` keyword argument. Writers are then reused between
+    calls, which makes serializing many small elements faster.
+
     """
     import io
 
+    config = kwargs.pop("config", None)
+    if config is None:
+        if args or kwargs:
+            config = WriterConfig(*args, **kwargs)
+        else:
+            config = _default_config
+    elif args or kwargs:
+        raise TypeError("config can't be combined with other writer options")
+
     out = io.BytesIO()
-    writer = XMLWriter(out, *args, **kwargs)
+    writer = config._acquire(out)
     writer.element(element)
     writer.close()
+    config._release(writer)
     return out.getvalue()
 
 
@@ -146,11 +303,172 @@ class XMLSyntaxError(Exception):
     """XML syntactic errors, such as ill-nestedness."""
 
 
+class WriterConfig(object):
+    """Compiled, immutable `XMLWriter` configuration.
+
+    All the work of setting up a writer (such as building a custom
+    attribute sort order) is done once, when the configuration is
+    created. A single `WriterConfig` can then be shared by any number
+    of writers, in any number of threads.
+
+    """
+
+    __slots__ = (
+        "encoding",
+        "pretty_print",
+        "sort",
+        "abbrev_empty",
+        "trusted",
+        "debug",
+        "formatters",
+        "float_format",
+        "date_format",
+        "_pool",
+        "_attribute_formatters",
+        "_cdata_formatters",
+    )
+
+    def __init__(
+        self,
+        encoding="utf-8",
+        pretty_print=False,
+        sort=True,
+        abbrev_empty=True,
+        trusted=False,
+        debug=False,
+        formatters=None,
+        float_format=None,
+        date_format=None,
+    ):
+        """
+        Create a writer configuration. The arguments are the same as
+        for `XMLWriter`.
+        """
+        if trusted and debug:
+            raise ValueError("trusted and debug modes are mutually exclusive")
+        if isinstance(sort, dict):
+            sort = sorter_factory(sort)
+        elif sort:
+            sort = _sort_attributes
+        set_ = super(WriterConfig, self).__setattr__
+        set_("encoding", encoding)
+        set_("pretty_print", pretty_print)
+        set_("sort", sort)
+        set_("abbrev_empty", abbrev_empty)
+        set_("trusted", trusted)
+        set_("debug", debug)
+        set_("formatters", types.MappingProxyType(dict(formatters or {})))
+        set_("float_format", float_format)
+        set_("date_format", date_format)
+        # Formatters resolved so far, by exact type, for attribute
+        # values and character data respectively.
+        set_("_attribute_formatters", {str: _escape_attribute_text})
+        set_("_cdata_formatters", {str: _escape_cdata_text})
+        # Idle writers, for reuse by tostring(). list.append() and
+        # list.pop() are atomic, so no locking is needed.
+        set_("_pool", [])
+
+    def __setattr__(self, name, value):
+        raise AttributeError("WriterConfig objects are immutable")
+
+    def _formatter(self, cls, attribute):
+        """Return a function that converts a value of type `cls` to
+        escaped text, for use in an attribute value if `attribute` is
+        true, or as character data otherwise."""
+        if attribute:
+            table, escape = self._attribute_formatters, _escape_attribute_text
+        else:
+            table, escape = self._cdata_formatters, _escape_cdata_text
+        try:
+            return table[cls]
+        except KeyError:
+            pass
+        # User formatters for any base class take precedence over the
+        # built-in rules, even for more specific classes (such as a
+        # date formatter for datetimes). Strings are never formatted.
+        for base in cls.__mro__:
+            if base is str:
+                break
+            if base in self.formatters:
+                formatter = _escaped(self.formatters[base], escape)
+                table[cls] = formatter
+                return formatter
+        formatter = None
+        for base in cls.__mro__:
+            if base is str:
+                formatter = escape
+            elif base is float and self.float_format is not None:
+                # A fill character in the spec could be anything
+                formatter = _escaped(
+                    functools.partial(_format_float, spec=self.float_format), escape
+                )
+            elif base in _DATE_TYPES and self.date_format is not None:
+                formatter = _escaped(
+                    operator.methodcaller("strftime", self.date_format), escape
+                )
+            elif base in _MARKUP_FREE_FORMATTERS:
+                formatter = _MARKUP_FREE_FORMATTERS[base]
+            if formatter is not None:
+                break
+        else:
+            formatter = _escaped(str, escape)
+        table[cls] = formatter
+        return formatter
+
+    def _acquire(self, file):
+        """Return an idle writer that writes its output to `file`."""
+        try:
+            writer = self._pool.pop()
+        except IndexError:
+            return XMLWriter(file, config=self)
+        writer.reset(file)
+        return writer
+
+    def _release(self, writer):
+        """Return a writer acquired with `_acquire()` to the pool."""
+        writer.file = None
+        self._pool.append(writer)
+
+
+def _sort_attributes(attributes, tag):
+    attributes.sort(key=_attribute_name)
+
+
+_DATE_TYPES = (datetime.datetime, datetime.date)
+
+
+def _format_float(value, spec):
+    return format(value, spec)
+
+
+def _escaped(format, escape):
+    """Return a formatter that escapes the output of `format`."""
+
+    def formatter(value):
+        return escape(format(value))
+
+    return formatter
+
+
+_default_config = WriterConfig()
+
+
 class XMLWriter(object):
     """Stream XML writer"""
 
     def __init__(
-        self, file, encoding="utf-8", pretty_print=False, sort=True, abbrev_empty=True
+        self,
+        file,
+        encoding="utf-8",
+        pretty_print=False,
+        sort=True,
+        abbrev_empty=True,
+        trusted=False,
+        debug=False,
+        formatters=None,
+        float_format=None,
+        date_format=None,
+        config=None,
     ):
         """
         Create an `XMLWriter` that writes its output to `file`.
@@ -176,16 +494,79 @@ class XMLWriter(object):
             "foo": ["id", None, "put_me_last"],
         }
 
+        If `trusted` is true, `start()` and `end()` skip all input
+        checking and normalization: names may be given pre-split as
+        ``(uri, local_name)`` tuples, attributes are written without
+        merging `attributes` and keyword arguments (so duplicates are
+        not detected), and end tag names are not matched against the
+        open element. Only use this for input known to be correct.
+
+        If `debug` is true, everything is checked instead: in addition
+        to the usual end tag matching, tag and attribute names must be
+        valid XML names, and attribute values, character data,
+        comments and processing instructions must not contain
+        characters that are illegal in XML, namespace prefixes must be
+        valid, comments can't contain ``--``, and processing
+        instructions can't contain ``?>`` or use the target ``xml``.
+        Violations raise `XMLSyntaxError`.
+
+        Attribute values and character data don't have to be strings.
+        Integers, floats, decimals, booleans (as ``true``/``false``),
+        dates, datetimes and times (in ISO 8601 format) are formatted
+        without escaping, since they never contain markup. `None`
+        attribute values and data are left out, and values of any
+        other type are converted with ``str()`` and escaped.
+
+        `formatters` is an optional dictionary mapping types to
+        functions that convert values of that type (or a subclass) to
+        strings, which are then escaped. `float_format` is a format
+        spec for floats (e.g. ``".2f"``), and `date_format` a
+        ``strftime()`` format for dates and datetimes.
+
+        Instead of the options above, a precompiled `WriterConfig`
+        can be given as `config`. Combining it with any other option
+        raises a `TypeError`.
+
+        """
+        options = (
+            encoding,
+            pretty_print,
+            sort,
+            abbrev_empty,
+            trusted,
+            debug,
+            formatters,
+            float_format,
+            date_format,
+        )
+        if config is None:
+            config = WriterConfig(*options)
+        elif options != XMLWriter.__init__.__defaults__[:-1]:
+            # Options left at their defaults can't be told apart from
+            # ones that weren't given, and are harmless either way
+            raise TypeError("config can't be combined with other writer options")
+        self.config = config
+        self.encoding = config.encoding
+        self._pretty_print = config.pretty_print
+        self._sort = config.sort
+        self._abbrev_empty = config.abbrev_empty
+        self._debug = config.debug
+        self._formatter = config._formatter
+        if config.trusted:
+            self.start = self._start_trusted
+            self.end = self._end_trusted
+        elif config.debug:
+            self.start = self._start_debug
+        self.reset(file)
+
+    def reset(self, file):
+        """Discard all state and start writing a new document to
+        `file`.
+
+        This lets a writer be reused for many documents. Writers are
+        not thread-safe, though; use one writer per thread.
         """
         self.file = file
-        self.encoding = encoding
-        self._pretty_print = pretty_print
-        self._sort = sort
-        if isinstance(sort, dict):
-            self._sort = sorter_factory(sort)
-        elif sort:
-            self._sort = lambda attributes, tag: attributes.sort()
-        self._abbrev_empty = abbrev_empty
         self._tags = []
         self._start_tag_open = False
         self._new_namespaces = {}
@@ -201,15 +582,9 @@ class XMLWriter(object):
                 datum = bytes(datum, self.encoding)
             self.file.write(datum)
 
-    def start(self, tag, attributes=None, nsmap=None, **kwargs):
-        """Open a new `tag` element.
-
-        Attributes can be given as a dictionary (`attributes`), or as
-        keyword arguments.
-
-        `nsmap` is an optional dictionary mapping namespace prefixes
-        to URIs. It is intended mainly for lxml compatibility.
-        """
+    def _open_scope(self, nsmap):
+        """Finish any open start tag and return the ``(old, new)``
+        namespace mappings for a new element."""
         self._started = True
         if self._start_tag_open:
             self.write(">")
@@ -222,6 +597,8 @@ class XMLWriter(object):
             _, old_namespaces, _ = self._tags[-1]
         else:
             old_namespaces = {"": ""}
+        if not (nsmap or self._new_namespaces):
+            return old_namespaces, old_namespaces.copy()
         namespaces = old_namespaces.copy()
         if nsmap:
             self._new_namespaces.update(reversed(item) for item in nsmap.items())
@@ -231,6 +608,34 @@ class XMLWriter(object):
                 del namespaces[uri]
 
         namespaces.update(self._new_namespaces)
+        return old_namespaces, namespaces
+
+    def _write_namespaces(self, old_namespaces, namespaces):
+        """Write namespace declarations for all new mappings."""
+        if len(namespaces) == len(old_namespaces) and namespaces == old_namespaces:
+            return
+        for (uri, prefix) in sorted(namespaces.items(), key=lambda x: x[1]):
+            if uri not in old_namespaces or old_namespaces.get(uri) != prefix:
+                if self._debug:
+                    _check_namespace(prefix, uri)
+                value = escape_attribute(uri, self.encoding)
+                if prefix:
+                    self.write(
+                        " xmlns:", bytes(prefix, self.encoding), '="', value, '"'
+                    )
+                else:
+                    self.write(' xmlns="', value, '"')
+
+    def start(self, tag, attributes=None, nsmap=None, **kwargs):
+        """Open a new `tag` element.
+
+        Attributes can be given as a dictionary (`attributes`), or as
+        keyword arguments.
+
+        `nsmap` is an optional dictionary mapping namespace prefixes
+        to URIs. It is intended mainly for lxml compatibility.
+        """
+        old_namespaces, namespaces = self._open_scope(nsmap)
         cnames = {}
 
         # Write tag name (cname)
@@ -246,22 +651,19 @@ class XMLWriter(object):
             for (name, value) in attributes
         ]
 
-        # Write namespace declarations for all new mappings
-        for (uri, prefix) in sorted(namespaces.items(), key=lambda x: x[1]):
-            if uri not in old_namespaces or old_namespaces.get(uri) != prefix:
-                value = escape_attribute(uri, self.encoding)
-                if prefix:
-                    self.write(
-                        " xmlns:", bytes(prefix, self.encoding), '="', value, '"'
-                    )
-                else:
-                    self.write(' xmlns="', value, '"')
+        self._write_namespaces(old_namespaces, namespaces)
 
         # Write the attributes
         if self._sort:
             self._sort(attributes, tag)
         for (name, cname, value) in attributes:
-            value = escape_attribute(value, self.encoding)
+            if value.__class__ is str:
+                value = escape_attribute(value, self.encoding)
+            elif value is None:
+                continue
+            else:
+                value = self._formatter(value.__class__, True)(value)
+                value = value.encode(self.encoding, "xmlcharrefreplace")
             self.write(" ", cname, '="', value, '"')
 
         self._new_namespaces = {}
@@ -269,6 +671,84 @@ class XMLWriter(object):
         self._wrote_data = False
         self._tags.append((tag, namespaces, cnames))
 
+    def _start_trusted(self, tag, attributes=None, nsmap=None, **kwargs):
+        """Open a new `tag` element without checking or normalizing
+        the input (used when the writer is created with
+        ``trusted=True``).
+
+        Names may be given pre-split as ``(uri, local_name)`` tuples.
+        Attributes from `attributes` and `kwargs` are written as they
+        are iterated; duplicate names are not detected.
+        """
+        old_namespaces, namespaces = self._open_scope(nsmap)
+        cnames = {}
+
+        if tag.__class__ is not tuple:
+            tag = _nssplitname(tag)
+        self.write("<", _cname(tag, namespaces, cnames))
+
+        if kwargs:
+            items = list(kwargs.items())
+            if attributes:
+                items.extend(attributes.items())
+        elif attributes:
+            items = attributes.items()
+        else:
+            items = ()
+
+        # Attribute cnames may introduce new namespace prefixes, so
+        # the attributes are written after the declarations, in one
+        # go.
+        formatter = self._formatter
+        if self._sort:
+            attributes = []
+            for (name, value) in items:
+                if name.__class__ is not tuple:
+                    name = _nssplitname(name)
+                attributes.append((name, _cname(name, namespaces, cnames), value))
+            self._sort(attributes, tag)
+            text = "".join(
+                [
+                    " %s=\"%s\"" % (cname, formatter(value.__class__, True)(value))
+                    for (name, cname, value) in attributes
+                    if value is not None
+                ]
+            )
+        else:
+            text = "".join(
+                [
+                    " %s=\"%s\""
+                    % (
+                        _cname(name, namespaces, cnames),
+                        formatter(value.__class__, True)(value),
+                    )
+                    for (name, value) in items
+                    if value is not None
+                ]
+            )
+        self._write_namespaces(old_namespaces, namespaces)
+        if text:
+            self.file.write(text.encode(self.encoding, "xmlcharrefreplace"))
+
+        self._new_namespaces = {}
+        self._start_tag_open = True
+        self._wrote_data = False
+        self._tags.append((tag, namespaces, cnames))
+
+    def _start_debug(self, tag, attributes=None, nsmap=None, **kwargs):
+        """Open a new `tag` element after checking that all names and
+        values are legal XML (used when the writer is created with
+        ``debug=True``)."""
+        _check_name(tag)
+        if nsmap:
+            for (prefix, uri) in nsmap.items():
+                _check_namespace(prefix, uri)
+        for (name, value) in list((attributes or {}).items()) + list(kwargs.items()):
+            _check_name(name)
+            if value is not None:
+                _check_chars(self._formatter(value.__class__, True)(value))
+        XMLWriter.start(self, tag, attributes, nsmap, **kwargs)
+
     def end(self, tag=None):
         """Close the most recently opened element.
 
@@ -283,6 +763,13 @@ class XMLWriter(object):
                 raise XMLSyntaxError(
                     "Start and end tag mismatch: %s and /%s." % (open_tag, tag)
                 )
+        self._write_end(open_tag, namespaces, cnames)
+
+    def _end_trusted(self, tag=None):
+        """Close the most recently opened element, ignoring `tag`."""
+        self._write_end(*self._tags.pop())
+
+    def _write_end(self, open_tag, namespaces, cnames):
         if self._start_tag_open:
             if self._abbrev_empty:
                 self.write(" />")
@@ -298,6 +785,8 @@ class XMLWriter(object):
     def start_ns(self, prefix, uri):
         """Add a namespace declaration to the scope of the next
         element."""
+        if self._debug:
+            _check_namespace(prefix, uri)
         self._new_namespaces[uri] = prefix
 
     def end_ns(self):
@@ -305,13 +794,30 @@ class XMLWriter(object):
         pass
 
     def data(self, data):
-        """Add character data."""
-        if not (self._pretty_print and not data.strip()):
-            if self._start_tag_open:
-                self.write(">")
-                self._start_tag_open = False
-            self.write(escape_cdata(data, self.encoding))
-            self._wrote_data = True
+        """Add character data.
+
+        `data` is normally a string, but can be any value that the
+        writer knows how to format (see the `XMLWriter` constructor).
+        `None` is ignored.
+        """
+        if data.__class__ is str:
+            if self._debug:
+                _check_chars(data)
+            if self._pretty_print and not data.strip():
+                return
+            data = escape_cdata(data, self.encoding)
+        elif data is None:
+            return
+        else:
+            data = self._formatter(data.__class__, False)(data)
+            if self._debug:
+                _check_chars(data)
+            data = data.encode(self.encoding, "xmlcharrefreplace")
+        if self._start_tag_open:
+            self.write(">")
+            self._start_tag_open = False
+        self.write(data)
+        self._wrote_data = True
 
     def element(self, element, attributes=None, data=None, **kwargs):
         if hasattr(element, "tag"):
@@ -334,10 +840,128 @@ class XMLWriter(object):
                 self.data(element.tail)
         else:
             self.start(element, attributes, **kwargs)
-            if data:
+            if data is not None and data != "":
                 self.data(data)
             self.end(element)
 
+    def rows(self, tag, columns, children=(), text=None):
+        """Write one `tag` element per row of tabular data.
+
+        `columns` is a dictionary mapping names to sequences of
+        values, all of the same length; row ``n`` is made up of the
+        ``n``th value of each column. Columns named in `children` are
+        written as child elements, the `text` column (if any) as the
+        element's character data, and all other columns as
+        attributes. `None` values are left out.
+
+        The output is the same as calling `start()`, `data()` and
+        `end()` for each row, but each column is converted, checked
+        for markup characters and escaped in bulk, and rows are
+        written in large chunks. NumPy arrays are accepted as columns,
+        but not accelerated: they are converted to lists first.
+
+        """
+        lengths = set(len(column) for column in columns.values())
+        if len(lengths) > 1:
+            raise ValueError("All columns must have the same length")
+        length = lengths.pop() if lengths else 0
+        if not length:
+            return
+        # Convert NumPy arrays to lists of Python values up front, so
+        # that both code paths below format them the same way.
+        columns = dict(
+            (name, column.tolist())
+            if hasattr(column, "dtype") and hasattr(column, "tolist")
+            else (name, column)
+            for (name, column) in columns.items()
+        )
+
+        tag = _nssplitname(tag)
+        if self._tags:
+            _, old_namespaces, _ = self._tags[-1]
+        else:
+            old_namespaces = {"": ""}
+        namespaces = old_namespaces.copy()
+        cnames = {}
+        ctag = _cname(tag, namespaces, cnames)
+        attributes = [
+            (_nssplitname(name), name)
+            for name in columns
+            if name != text and name not in children
+        ]
+        attributes = [
+            (name, _cname(name, namespaces, cnames), key)
+            for (name, key) in attributes
+        ]
+        ckids = [(_cname(name, namespaces, cnames), name) for name in children]
+        if (
+            self._pretty_print
+            or self._debug
+            or self._new_namespaces
+            or namespaces != old_namespaces
+        ):
+            # Pretty-printing, checking and namespace declarations
+            # all need the full treatment, row by row.
+            self._rows_slowly(tag, columns, children, text, length)
+            return
+        if self._sort:
+            self._sort(attributes, tag)
+
+        self._close_start()
+        self._started = True
+        self._wrote_data = False
+        if self._abbrev_empty:
+            empty = " />"
+        else:
+            empty = "></" + ctag + ">"
+        close = "</" + ctag + ">"
+        for offset in range(0, length, _ROWS_PER_CHUNK):
+            stop = offset + _ROWS_PER_CHUNK
+            heads = ["<" + ctag] * min(_ROWS_PER_CHUNK, length - offset)
+            for (name, cname, key) in attributes:
+                prefix = " " + cname + '="'
+                values = _format_column(columns[key][offset:stop], self.config, True)
+                heads = [
+                    head if value is None else head + prefix + value + '"'
+                    for (head, value) in zip(heads, values)
+                ]
+            if text is not None:
+                bodies = _format_column(columns[text][offset:stop], self.config, False)
+            else:
+                bodies = [None] * len(heads)
+            for (cname, key) in ckids:
+                start, end = "<" + cname + ">", "</" + cname + ">"
+                values = _format_column(columns[key][offset:stop], self.config, False)
+                bodies = [
+                    body if value is None else (body or "") + start + value + end
+                    for (body, value) in zip(bodies, values)
+                ]
+            chunk = "".join(
+                [
+                    head + empty if body is None else head + ">" + body + close
+                    for (head, body) in zip(heads, bodies)
+                ]
+            )
+            self.file.write(chunk.encode(self.encoding, "xmlcharrefreplace"))
+
+    def _rows_slowly(self, tag, columns, children, text, length):
+        """Write rows of tabular data one by one (see `rows()`)."""
+        for n in range(length):
+            attributes = {}
+            for (name, column) in columns.items():
+                if name != text and name not in children:
+                    attributes[name] = column[n]
+            self.start(tag, attributes)
+            if text is not None and columns[text][n] is not None:
+                self.data(columns[text][n])
+            for name in children:
+                value = columns[name][n]
+                if value is not None:
+                    self.start(name)
+                    self.data(value)
+                    self.end()
+            self.end()
+
     def _close_start(self):
         """Make sure the start tag is finished."""
         if self._start_tag_open:
@@ -351,7 +975,9 @@ class XMLWriter(object):
                 "Can't write XML declaration after root element has been started."
             )
         if not self._wrote_declaration:
-            self.pi("xml", "version='1.0' encoding='" + self.encoding + "'")
+            self._comment_or_pi(
+                "<?xml version='1.0' encoding='", self.encoding, "'?>"
+            )
             self._wrote_declaration = True
 
     xml = declaration
@@ -371,10 +997,21 @@ class XMLWriter(object):
 
     def comment(self, data):
         """Add an XML comment."""
+        if self._debug:
+            _check_chars(data)
+            if "--" in data or data.endswith("-"):
+                raise XMLSyntaxError("Comments can't contain '--' or end with '-'.")
         self._comment_or_pi("<!--", escape_cdata(data, self.encoding), "-->")
 
     def pi(self, target, data):
         """Add an XML processing instruction."""
+        if self._debug:
+            _check_name(target)
+            if target.lower() == "xml":
+                raise XMLSyntaxError("Reserved processing instruction target: xml")
+            _check_chars(data)
+            if "?>" in data:
+                raise XMLSyntaxError("Processing instructions can't contain '?>'.")
         self._comment_or_pi("<?", target, " ", data, "?>")
 
     def close(self):
@@ -414,3 +1051,423 @@ def delayed_iterator(iterable):
         yield previous
         previous = item
     yield previous
+
+
+def _unwrap_optional(annotation):
+    """Return ``X`` for an ``Optional[X]`` annotation, or the
+    annotation itself."""
+    args = getattr(annotation, "__args__", None)
+    if getattr(annotation, "__origin__", None) is Union and args:
+        args = [arg for arg in args if arg is not type(None)]  # noqa: E721
+        if len(args) == 1:
+            return args[0]
+    return annotation
+
+
+def _sequence_item_type(annotation):
+    """Return the item type if `annotation` is a list, tuple or
+    sequence type, ``object`` if the item type is unknown, or `None`
+    if it isn't a sequence type at all."""
+    if annotation in (list, tuple):
+        return object
+    origin = getattr(annotation, "__origin__", None)
+    if origin in (list, tuple, List, Tuple, Sequence, collections.abc.Sequence):
+        args = getattr(annotation, "__args__", None) or (object,)
+        if origin in (tuple, Tuple) and not (len(args) == 2 and args[1] is Ellipsis):
+            return object
+        return args[0]
+    return None
+
+
+def _is_forward_ref(annotation):
+    """Return true if `annotation` is an unresolved forward reference."""
+    return isinstance(annotation, str) or type(annotation).__name__ in (
+        "ForwardRef",
+        "_ForwardRef",
+    )
+
+
+def _type_hints(cls):
+    """Return the resolved type annotations of `cls`.
+
+    Raise a `TypeError` naming the field if an annotation can't be
+    resolved (for instance, a string annotation referring to a class
+    defined inside a function).
+    """
+    try:
+        return get_type_hints(cls)
+    except Exception:
+        pass
+    hints = {}
+    for base in reversed(cls.__mro__):
+        module = sys.modules.get(base.__module__)
+        globalns = dict(getattr(module, "__dict__", {}))
+        globalns.setdefault(cls.__name__, cls)
+        for (name, annotation) in base.__dict__.get("__annotations__", {}).items():
+            if isinstance(annotation, str):
+                try:
+                    annotation = eval(annotation, globalns)
+                except Exception:
+                    raise TypeError(
+                        "Can't resolve the type annotation %r of field %r of %s"
+                        % (annotation, name, cls.__name__)
+                    )
+            hints[name] = annotation
+    return hints
+
+
+def _schema_fields(cls, slots=False):
+    """Return a list of ``(name, annotation)`` pairs for a dataclass,
+    NamedTuple or TypedDict (or, if `slots` is true, a ``__slots__``
+    class), along with a dictionary mapping each field name to the
+    code that looks up its value in ``obj``. Return `None` for other
+    types."""
+    if hasattr(cls, "__dataclass_fields__"):
+        import dataclasses
+
+        names = [field.name for field in dataclasses.fields(cls)]
+        getters = dict((name, "obj.%s" % name) for name in names)
+    elif issubclass(cls, tuple) and hasattr(cls, "_fields"):
+        names = list(cls._fields)
+        getters = dict((name, "obj.%s" % name) for name in names)
+    elif issubclass(cls, dict) and hasattr(cls, "__total__"):
+        names = None
+        getters = {}
+    elif not slots:
+        return None
+    else:
+        names = []
+        getters = {}
+        for base in reversed(cls.__mro__):
+            slots = base.__dict__.get("__slots__", ())
+            if isinstance(slots, str):
+                slots = (slots,)
+            for name in slots:
+                if name in ("__dict__", "__weakref__"):
+                    continue
+                attr = name
+                if name.startswith("__") and not name.endswith("__"):
+                    # Private names are mangled with the class name
+                    attr = "_%s%s" % (base.__name__.lstrip("_"), name)
+                names.append(name)
+                getters[name] = "getattr(obj, %r, None)" % attr
+        if not names:
+            return None
+    hints = _type_hints(cls)
+    if names is None:
+        # TypedDict
+        names = list(hints)
+        getters = dict((name, "obj.get(%r)" % name) for name in names)
+    return [(name, hints.get(name, object)) for name in names], getters
+
+
+class ObjectSerializer(object):
+    """Serialize objects as XML elements, using an `XMLWriter`.
+
+    Dataclasses, NamedTuples and TypedDicts are supported, as are
+    classes with `__slots__` once they have been passed to
+    `register()`. (Many value types, such as `uuid.UUID`, use
+    `__slots__` too, and are written as attribute values.) The first
+    time an object of a given type is serialized, its fields are
+    inspected and a function that writes exactly those fields is
+    generated. That function is then reused for all objects of the
+    same type.
+
+    By default, an object is written as an element named after its
+    class. Fields holding other supported objects, or lists of values,
+    become child elements named after the field (one per list item),
+    and all other fields become attributes. Fields whose value is
+    `None` are left out. Use `register()` to change this for a type.
+
+    """
+
+    def __init__(self):
+        self._options = {}
+        self._emitters = {}
+        self._compiling = set()
+
+    def register(self, cls, tag=None, attributes=None, text=None):
+        """Set serialization options for `cls`.
+
+        `tag` is the element name to use (default: the class name).
+        `attributes` is a list of the fields to write as attributes;
+        all other fields become child elements, in field order. `text`
+        is the name of a field to write as the element's character
+        data.
+
+        """
+        self._options[cls] = (tag, attributes, text)
+        # Emitters for other types may have inlined the old one
+        self._emitters.clear()
+
+    def write(self, writer, obj, tag=None, cls=None):
+        """Write `obj` as an element to `writer`.
+
+        `tag` overrides the element name. `cls` is the schema type to
+        use, which defaults to the type of `obj`; it must be given
+        for TypedDicts, since these are plain dicts at runtime.
+
+        """
+        if cls is None:
+            cls = type(obj)
+        try:
+            emit = self._emitters[cls]
+        except KeyError:
+            emit = self._emitter(cls)
+        emit(writer, obj, tag)
+
+    def _emitter(self, cls):
+        """Return the emit function for `cls`, generating it if
+        needed."""
+        try:
+            return self._emitters[cls]
+        except KeyError:
+            pass
+        self._compiling.add(cls)
+        try:
+            emit = self._emitters[cls] = self._compile(cls)
+        finally:
+            self._compiling.discard(cls)
+        return emit
+
+    def _compile(self, cls):
+        """Generate the emit function for `cls`."""
+        schema = _schema_fields(cls, slots=cls in self._options)
+        if schema is None:
+            raise TypeError("Can't serialize objects of type %s" % cls.__name__)
+        fields, getters = schema
+        for (name, annotation) in fields:
+            annotation = _unwrap_optional(annotation)
+            item_type = _unwrap_optional(_sequence_item_type(annotation))
+            if _is_forward_ref(annotation) or _is_forward_ref(item_type):
+                raise TypeError(
+                    "Can't resolve the type annotation of field %r of %s"
+                    % (name, cls.__name__)
+                )
+        default_tag, attributes, text = self._options.get(cls, (None, None, None))
+        if default_tag is None:
+            default_tag = cls.__name__
+
+        namespace = {"_write": self.write, "_default_tag": default_tag}
+        annotations = dict(fields)
+        if attributes is None:
+            attributes = [
+                name
+                for (name, annotation) in fields
+                if name != text and self._is_scalar(annotation)
+            ]
+        children = [
+            name for (name, _) in fields if name not in attributes and name != text
+        ]
+
+        # The writer leaves out None attribute values and data
+        lines = ["def emit(writer, obj, tag):"]
+        lines.append("    attributes = {")
+        for name in attributes:
+            lines.append("        %r: %s," % (name, getters[name]))
+        lines.append("    }")
+        lines.append("    writer.start(tag or _default_tag, attributes)")
+        if text is not None:
+            lines.append("    writer.data(%s)" % getters[text])
+        for n, name in enumerate(children):
+            annotation = _unwrap_optional(annotations[name])
+            item_type = _sequence_item_type(annotation)
+            lines.append("    value = %s" % getters[name])
+            if item_type is None:
+                lines.append("    if value is not None:")
+                lines.extend(self._child_lines(name, annotation, n, namespace, 8))
+            else:
+                lines.append("    for value in value or ():")
+                item_type = _unwrap_optional(item_type)
+                lines.extend(self._child_lines(name, item_type, n, namespace, 8))
+        lines.append("    writer.end()")
+
+        exec("\n".join(lines), namespace)
+        return namespace["emit"]
+
+    def _is_schema(self, annotation):
+        """Return true if values of type `annotation` are written as
+        nested elements."""
+        return isinstance(annotation, type) and bool(
+            _schema_fields(annotation, slots=annotation in self._options)
+        )
+
+    def _is_scalar(self, annotation):
+        annotation = _unwrap_optional(annotation)
+        if _sequence_item_type(annotation) is not None:
+            return False
+        return not self._is_schema(annotation)
+
+    def _child_lines(self, name, annotation, n, namespace, indent):
+        """Return code that writes `value` as a child element."""
+        indent = " " * indent
+        if self._is_schema(annotation):
+            if annotation in self._compiling:
+                # Recursive type; look up its emitter at runtime
+                namespace["_cls%d" % n] = annotation
+                return [indent + "_write(writer, value, %r, _cls%d)" % (name, n)]
+            namespace["_emit%d" % n] = self._emitter(annotation)
+            return [indent + "_emit%d(writer, value, %r)" % (n, name)]
+        return [
+            indent + "writer.start(%r)" % name,
+            indent + "writer.data(value)",
+            indent + "writer.end()",
+        ]
+
+
+class OutputCounter(object):
+    """A sink that counts the bytes and elements written to it.
+
+    Elements are counted by their start tags, so the count is only
+    accurate for output from an `XMLWriter` (where ``<`` in attribute
+    values, character data and comments is always escaped). Every
+    ``<`` in the data of a processing instruction, which is not
+    escaped, is counted as an extra element.
+    """
+
+    def __init__(self):
+        self.bytes = 0
+        self.elements = 0
+        self._pending_lt = False
+
+    def write(self, data):
+        self.bytes += len(data)
+        if not data:
+            return
+        lts = data.count(b"<")
+        if lts or self._pending_lt:
+            if self._pending_lt and data[:1] in (b"/", b"!", b"?"):
+                self.elements -= 1
+            self.elements += (
+                lts - data.count(b"</") - data.count(b"<!") - data.count(b"<?")
+            )
+            self._pending_lt = data.endswith(b"<")
+
+
+class _SinkThread(object):
+    """Feed chunks to a sink from a background thread."""
+
+    def __init__(self, write, queue_size):
+        self._write = write
+        self._queue = queue.Queue(queue_size)
+        self.error = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                return
+            if self.error is None:
+                try:
+                    self._write(chunk)
+                except BaseException as e:
+                    self.error = e
+
+    def write(self, chunk):
+        self._queue.put(chunk)
+
+    def join(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+class MultiSink(object):
+    """A file-like object that writes its input to several sinks.
+
+    Use a `MultiSink` as the output file of an `XMLWriter` to
+    serialize a document once, but send it to several places. A sink
+    is either a file-like object with a ``write()`` method, or an
+    object with an ``update()`` method, such as a `hashlib` digest.
+
+    Output is collected into chunks of at least `buffer_size` bytes,
+    and each chunk is passed, as the same bytes object, to every sink.
+
+    If `threaded` is true, each sink is fed from its own background
+    thread instead, so that one slow sink (e.g. a compressor) doesn't
+    hold back the others until its queue of `queue_size` chunks is
+    full. `threaded` can also be a list of the sinks that should get
+    a thread. Exceptions in background threads are raised as soon as
+    the next chunk is ready, or from `flush()` or `close()`.
+
+    Call `close()` when done, to write any buffered output. It does
+    not close the sinks themselves.
+    """
+
+    def __init__(self, sinks, buffer_size=65536, threaded=False, queue_size=16):
+        self.sinks = list(sinks)
+        self._buffer = []
+        self._buffered = 0
+        self._buffer_size = buffer_size
+        self._threads = []
+        self._writes = []
+        for sink in self.sinks:
+            write = getattr(sink, "write", None) or sink.update
+            if threaded is True or (threaded and sink in threaded):
+                thread = _SinkThread(write, queue_size)
+                self._threads.append(thread)
+                write = thread.write
+            self._writes.append(write)
+        self.closed = False
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed MultiSink")
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self._buffer_size:
+            self._dispatch()
+        return len(data)
+
+    def _dispatch(self):
+        """Pass the buffered output to all sinks."""
+        self._check_threads()
+        if len(self._buffer) == 1:
+            chunk = self._buffer[0]
+        else:
+            chunk = b"".join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        if chunk:
+            for write in self._writes:
+                write(chunk)
+
+    def _check_threads(self):
+        for thread in self._threads:
+            if thread.error is not None:
+                raise thread.error
+
+    def flush(self):
+        """Pass all buffered output on to the sinks, and flush those
+        that can be flushed.
+
+        With background threads, sinks are not flushed, and the
+        output may still be on its way to them.
+        """
+        self._dispatch()
+        self._check_threads()
+        if not self._threads:
+            for sink in self.sinks:
+                if hasattr(sink, "flush"):
+                    sink.flush()
+
+    def close(self):
+        """Write any buffered output, and wait for background threads
+        to finish."""
+        if self.closed:
+            return
+        try:
+            self._dispatch()
+        finally:
+            self.closed = True
+            for thread in self._threads:
+                thread.join()
+        self._check_threads()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
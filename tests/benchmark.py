@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+"""Benchmarks for Stream XML Writer module.
+
+Run from the top-level directory with ``python tests/benchmark.py``,
+optionally followed by the names of the benchmarks to run.
+"""
+
+import os
+import sys
+import timeit
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from streamxmlwriter import (  # noqa: E402
+    MultiSink,
+    ObjectSerializer,
+    OutputCounter,
+    WriterConfig,
+    XMLWriter,
+    tostring,
+)
+
+
+RECORDS = [
+    {"id": str(n), "name": "Person %d" % n, "email": "p%d@example.org" % n}
+    for n in range(1000)
+]
+
+
+def write_records(**kwargs):
+    w = XMLWriter(BytesIO(), **kwargs)
+    w.start("people")
+    for record in RECORDS:
+        w.start("person", record)
+        w.start("name")
+        w.data(record["name"])
+        w.end("name")
+        w.end("person")
+    w.close()
+
+
+def bench_modes():
+    """Attribute-heavy records in default, trusted and debug mode."""
+    for mode in ("default", "trusted", "debug"):
+        kwargs = {mode: True} if mode != "default" else {}
+        yield mode, lambda kwargs=kwargs: write_records(**kwargs)
+
+
+def bench_small_documents():
+    """1000 small documents with tostring(), a custom sort order."""
+    from xml.etree import ElementTree
+
+    order = {"person": ["id", None], "name": ["first", "last"]}
+    elements = []
+    for record in RECORDS:
+        elem = ElementTree.Element("person", id=record["id"], email=record["email"])
+        ElementTree.SubElement(elem, "name", first="A", last="B").text = record["name"]
+        elements.append(elem)
+    config = WriterConfig(sort=order)
+
+    def plain():
+        for elem in elements:
+            tostring(elem, sort=order)
+
+    def shared_config():
+        for elem in elements:
+            tostring(elem, config=config)
+
+    def pooled_writer():
+        writer = XMLWriter(None, config=config)
+        for elem in elements:
+            writer.reset(BytesIO())
+            writer.element(elem)
+            writer.close()
+
+    yield "tostring(sort=...)", plain
+    yield "tostring(config=...)", shared_config
+    yield "reset() one writer", pooled_writer
+
+
+def bench_objects():
+    """1000 objects with ObjectSerializer and by hand."""
+    import typing
+
+    Name = typing.NamedTuple("Name", [("first", str), ("last", str)])
+    Person = typing.NamedTuple(
+        "Person",
+        [("id", int), ("email", str), ("name", Name), ("tags", typing.List[str])],
+    )
+    people = [
+        Person(n, record["email"], Name("A", record["name"]), ["x", "y"])
+        for (n, record) in enumerate(RECORDS)
+    ]
+
+    def by_hand():
+        w = XMLWriter(BytesIO())
+        w.start("people")
+        for person in people:
+            w.start("Person", id=str(person.id), email=person.email)
+            w.start("name", first=person.name.first, last=person.name.last)
+            w.end()
+            for tag in person.tags:
+                w.start("tags")
+                w.data(tag)
+                w.end()
+            w.end()
+        w.close()
+
+    def serializer():
+        serializer = ObjectSerializer()
+        w = XMLWriter(BytesIO())
+        w.start("people")
+        for person in people:
+            serializer.write(w, person)
+        w.close()
+
+    yield "hand-written loop", by_hand
+    yield "ObjectSerializer", serializer
+
+
+def bench_rows():
+    """10000 rows of tabular data, with rows() and row by row."""
+    ids = list(range(10000))
+    names = ["Person %d" % n for n in ids]
+    emails = ["p%d@example.org" % n for n in ids]
+    scores = [n * 0.25 for n in ids]
+
+    def by_row():
+        w = XMLWriter(BytesIO())
+        w.start("people")
+        for n in ids:
+            w.start("person", id=str(ids[n]), score=str(scores[n]))
+            w.start("name")
+            w.data(names[n])
+            w.end()
+            w.start("email")
+            w.data(emails[n])
+            w.end()
+            w.end()
+        w.close()
+
+    def columnar():
+        w = XMLWriter(BytesIO())
+        w.start("people")
+        columns = {"id": ids, "score": scores, "name": names, "email": emails}
+        w.rows("person", columns, children=["name", "email"])
+        w.close()
+
+    yield "row by row", by_row
+    yield "rows()", columnar
+
+
+def bench_typed_values():
+    """1000 numeric records, converted by hand and as typed values."""
+    import datetime
+    import decimal
+
+    records = [
+        (n, n * 1.5, decimal.Decimal(n) / 100, n % 2 == 0, datetime.date(2020, 1, 1))
+        for n in range(1000)
+    ]
+
+    def by_hand():
+        w = XMLWriter(BytesIO())
+        w.start("values")
+        for (a, b, c, d, e) in records:
+            w.start("v", a=str(a), b=repr(b), c=str(c), d="true" if d else "false")
+            w.data(e.isoformat())
+            w.end()
+        w.close()
+
+    def typed():
+        w = XMLWriter(BytesIO())
+        w.start("values")
+        for (a, b, c, d, e) in records:
+            w.start("v", a=a, b=b, c=c, d=d)
+            w.data(e)
+            w.end()
+        w.close()
+
+    def typed_rows():
+        w = XMLWriter(BytesIO())
+        w.start("values")
+        columns = dict(zip("abcde", zip(*records)))
+        w.rows("v", columns, text="e")
+        w.close()
+
+    yield "str() by hand", by_hand
+    yield "typed values", typed
+    yield "typed values, rows()", typed_rows
+
+
+def bench_sinks():
+    """A ~5 MB document to a file, a gzip file and two digests."""
+    import gzip
+    import hashlib
+    import tempfile
+
+    ids = list(range(100000))
+    columns = {"id": ids, "name": ["Person %d" % n for n in ids]}
+
+    def write_document(file):
+        w = XMLWriter(file)
+        w.start("people")
+        w.rows("person", columns, text="name")
+        w.close()
+
+    def read_back():
+        with tempfile.TemporaryFile() as out:
+            write_document(out)
+            out.seek(0)
+            gzip_file = gzip.GzipFile(fileobj=BytesIO(), mode="wb")
+            sha256, md5, counter = hashlib.sha256(), hashlib.md5(), OutputCounter()
+            for chunk in iter(lambda: out.read(65536), b""):
+                gzip_file.write(chunk)
+                sha256.update(chunk)
+                md5.update(chunk)
+                counter.write(chunk)
+            gzip_file.close()
+
+    def fan_out(threaded):
+        with tempfile.TemporaryFile() as out:
+            gzip_file = gzip.GzipFile(fileobj=BytesIO(), mode="wb")
+            sinks = [out, gzip_file, hashlib.sha256(), hashlib.md5(), OutputCounter()]
+            with MultiSink(sinks, threaded=threaded) as sink:
+                write_document(sink)
+            gzip_file.close()
+
+    yield "write, then read back", read_back
+    yield "MultiSink", lambda: fan_out(False)
+    yield "MultiSink, threaded", lambda: fan_out(True)
+
+
+BENCHMARKS = [
+    bench_modes,
+    bench_small_documents,
+    bench_objects,
+    bench_rows,
+    bench_typed_values,
+    bench_sinks,
+]
+
+
+def main(names):
+    for bench in BENCHMARKS:
+        if names and bench.__name__[len("bench_"):] not in names:
+            continue
+        print("%s: %s" % (bench.__name__[len("bench_"):], bench.__doc__))
+        for label, func in bench():
+            timer = timeit.Timer(func)
+            number, _ = timer.autorange()
+            best = min(timer.repeat(5, number)) / number
+            print("  %-24s %10.3f ms" % (label, 1000.0 * best))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
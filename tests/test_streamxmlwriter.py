@@ -23,7 +23,23 @@
 
 import unittest
 from io import BytesIO
-from streamxmlwriter import XMLWriter, XMLSyntaxError, tostring
+import datetime
+import decimal
+import typing
+from streamxmlwriter import (
+    MultiSink,
+    ObjectSerializer,
+    OutputCounter,
+    WriterConfig,
+    XMLWriter,
+    XMLSyntaxError,
+    tostring,
+)
+
+try:
+    import dataclasses
+except ImportError:
+    dataclasses = None
 
 
 class XMLWriterTestCase(unittest.TestCase):
@@ -243,6 +259,13 @@ class TestNamespaces(XMLWriterTestCase):
             b"</a:foo>",
         )
 
+    def test_xml_namespace(self):
+        w = XMLWriter(BytesIO())
+        w.start("foo", {"{http://www.w3.org/XML/1998/namespace}lang": "en"})
+        w.start("{http://www.w3.org/XML/1998/namespace}bar")
+        w.close()
+        self.assertOutput(w, b'<foo xml:lang="en"><xml:bar /></foo>')
+
     def test_attributes_same_local_name(self):
         w = XMLWriter(BytesIO())
         w.start_ns("a", "http://example.org/ns1")
@@ -293,6 +316,537 @@ class TestNamespaces(XMLWriterTestCase):
         )
 
 
+class TestTrusted(XMLWriterTestCase):
+    def test_presplit_names(self):
+        w = XMLWriter(BytesIO(), trusted=True)
+        w.start_ns("a", "http://example.org/ns")
+        w.start(("http://example.org/ns", "foo"), {("", "b"): "2"}, a="1")
+        w.data("x")
+        w.end()
+        self.assertOutput(
+            w, b'<a:foo xmlns:a="http://example.org/ns" a="1" b="2">x</a:foo>'
+        )
+
+    def test_unsorted_keeps_order(self):
+        w = XMLWriter(BytesIO(), trusted=True, sort=False)
+        w.start("foo", {"{http://example.org/ns}z": "<", "y": "&"})
+        w.close()
+        self.assertOutput(
+            w, b'<foo xmlns:ns2="http://example.org/ns" ns2:z="&lt;" y="&amp;" />'
+        )
+
+    def test_duplicate_typed_attributes(self):
+        for sort in (True, {"b": ["x"]}):
+            w = XMLWriter(BytesIO(), trusted=True, sort=sort)
+            w.start("a", {"x": 1}, x=None)
+            w.close()
+            self.assertOutput(w, b'<a x="1" />')
+
+    def test_end_tag_not_matched(self):
+        w = XMLWriter(BytesIO(), trusted=True)
+        w.start("a")
+        w.end("b")
+        self.assertOutput(w, b"<a />")
+
+    def test_same_output_as_default(self):
+        outputs = []
+        for trusted in (False, True):
+            w = XMLWriter(BytesIO(), pretty_print=True, trusted=trusted)
+            w.start("a", {"c": "3", "b": "2"}, nsmap={"x": "http://example.org/ns"})
+            w.element("{http://example.org/ns}b", data="<&>", d="4")
+            w.close()
+            outputs.append(w.file.getvalue())
+        self.assertEqual(outputs[0], outputs[1])
+
+
+class TestDebug(XMLWriterTestCase):
+    def test_valid_document(self):
+        w = XMLWriter(BytesIO(), debug=True)
+        w.start("{http://example.org/ns}a-b.c", {"_d": "\u2603"})
+        w.data("text\n")
+        w.comment("comment")
+        w.pi("target", "data")
+        w.end("{http://example.org/ns}a-b.c")
+        self.assertOutput(
+            w,
+            b'<ns2:a-b.c xmlns:ns2="http://example.org/ns" _d="\xe2\x98\x83">'
+            b"text\n<!--comment--><?target data?></ns2:a-b.c>",
+        )
+
+    def test_invalid_names(self):
+        for name in ("", "1a", "a b", "a:b", "{ns}-a"):
+            w = XMLWriter(BytesIO(), debug=True)
+            self.assertRaises(XMLSyntaxError, w.start, name)
+            self.assertRaises(XMLSyntaxError, w.start, "a", {name: "x"})
+
+    def test_illegal_characters(self):
+        w = XMLWriter(BytesIO(), debug=True)
+        self.assertRaises(XMLSyntaxError, w.start, "a", {"b": "\x00"})
+        w.start("a")
+        self.assertRaises(XMLSyntaxError, w.data, "\x1b")
+        self.assertRaises(XMLSyntaxError, w.comment, "\ufffe")
+        self.assertRaises(XMLSyntaxError, w.pi, "target", "\x0c")
+
+    def test_malformed_namespaced_name(self):
+        w = XMLWriter(BytesIO(), debug=True)
+        self.assertRaises(XMLSyntaxError, w.start, "{abc")
+
+    def test_comment(self):
+        w = XMLWriter(BytesIO(), debug=True)
+        self.assertRaises(XMLSyntaxError, w.comment, "a--b")
+        self.assertRaises(XMLSyntaxError, w.comment, "a-")
+
+    def test_pi(self):
+        w = XMLWriter(BytesIO(), debug=True)
+        self.assertRaises(XMLSyntaxError, w.pi, "t", "?>")
+        self.assertRaises(XMLSyntaxError, w.pi, "xml", "version='1.0'")
+        self.assertRaises(XMLSyntaxError, w.pi, "XmL", "")
+
+    def test_declaration(self):
+        w = XMLWriter(BytesIO(), encoding="iso-8859-1", debug=True)
+        w.start("a")
+        w.close()
+        self.assertOutput(w, b"<?xml version='1.0' encoding='iso-8859-1'?><a />")
+
+    def test_namespaces(self):
+        w = XMLWriter(BytesIO(), debug=True)
+        for prefix in ("1", "a:b", "xmlns", "xml"):
+            self.assertRaises(XMLSyntaxError, w.start_ns, prefix, "http://e.org/")
+            self.assertRaises(
+                XMLSyntaxError, w.start, "a", nsmap={prefix: "http://e.org/"}
+            )
+        self.assertRaises(XMLSyntaxError, w.start_ns, "a", "\x00")
+        w.start_ns("", "http://e.org/")
+        w.start("a", nsmap={"b": "http://e.org/b"})
+        w.close()
+        self.assertOutput(
+            w, b'<a xmlns="http://e.org/" xmlns:b="http://e.org/b" />'
+        )
+
+    def test_xml_prefix(self):
+        w = XMLWriter(BytesIO(), debug=True)
+        w.start("a", {"xml:lang": "en"})
+        w.start("b", {"{http://www.w3.org/XML/1998/namespace}space": "preserve"})
+        w.close()
+        self.assertOutput(w, b'<a xml:lang="en"><b xml:space="preserve" /></a>')
+        for name in ("xml:", "xml:a:b", "{http://e.org/}xml:lang"):
+            self.assertRaises(XMLSyntaxError, w.start, name)
+
+    def test_generated_prefixes(self):
+        w = XMLWriter(BytesIO(), debug=True)
+        self.assertRaises(
+            XMLSyntaxError, w.start, "{http://www.w3.org/2000/xmlns/}a"
+        )
+
+    def test_not_checked_by_default(self):
+        w = XMLWriter(BytesIO())
+        w.start("a")
+        w.data("\x1b")
+        w.close()
+        self.assertOutput(w, b"<a>\x1b</a>")
+
+    def test_exclusive_with_trusted(self):
+        self.assertRaises(ValueError, XMLWriter, BytesIO(), trusted=True, debug=True)
+
+
+class TestWriterConfig(XMLWriterTestCase):
+    def test_shared_config(self):
+        config = WriterConfig(sort={"foo": ["b", None, "a"]}, abbrev_empty=False)
+        for _ in range(2):
+            w = XMLWriter(BytesIO(), config=config)
+            w.start("foo", a="1", b="2", c="3")
+            w.close()
+            self.assertOutput(w, b'<foo b="2" c="3" a="1"></foo>')
+
+    def test_immutable(self):
+        config = WriterConfig()
+        self.assertRaises(AttributeError, setattr, config, "encoding", "us-ascii")
+
+    def test_reset(self):
+        w = XMLWriter(BytesIO(), encoding="iso-8859-1")
+        w.start("a")
+        w.reset(BytesIO())
+        w.start("b")
+        w.close()
+        self.assertOutput(w, b"<?xml version='1.0' encoding='iso-8859-1'?><b />")
+
+    def test_tostring_reuses_writers(self):
+        from xml.etree import ElementTree
+
+        config = WriterConfig(sort=False)
+        elem = ElementTree.Element("foo", b="2", a="1")
+        self.assertEqual(tostring(elem, config=config), b'<foo b="2" a="1" />')
+        self.assertEqual(len(config._pool), 1)
+        writer = config._pool[0]
+        self.assertEqual(tostring(elem, config=config), b'<foo b="2" a="1" />')
+        self.assertEqual(config._pool, [writer])
+
+    def test_tostring_config_and_options(self):
+        self.assertRaises(TypeError, tostring, "foo", config=WriterConfig(), sort=False)
+
+    def test_writer_config_and_options(self):
+        config = WriterConfig()
+        for kwargs in ({"sort": False}, {"encoding": "us-ascii"}, {"formatters": {}}):
+            self.assertRaises(TypeError, XMLWriter, BytesIO(), config=config, **kwargs)
+        self.assertRaises(TypeError, XMLWriter, BytesIO(), "utf-8", True, config=config)
+
+
+class TestObjectSerializer(XMLWriterTestCase):
+    def serialize(self, obj, serializer=None, **kwargs):
+        w = XMLWriter(BytesIO())
+        (serializer or ObjectSerializer()).write(w, obj, **kwargs)
+        w.close()
+        return w.file.getvalue()
+
+    def test_namedtuple(self):
+        Point = typing.NamedTuple("Point", [("x", int), ("y", int)])
+        self.assertEqual(self.serialize(Point(1, 2)), b'<Point x="1" y="2" />')
+
+    @unittest.skipIf(dataclasses is None, "requires dataclasses")
+    def test_dataclass(self):
+        Address = dataclasses.make_dataclass("Address", [("city", str)])
+        Person = dataclasses.make_dataclass(
+            "Person",
+            [
+                ("name", str),
+                ("age", typing.Optional[int]),
+                ("address", Address),
+                ("emails", typing.List[str]),
+                ("addresses", typing.List[Address]),
+            ],
+        )
+        person = Person("A & B", None, Address("X"), ["a", "b"], [Address("Y")])
+        self.assertEqual(
+            self.serialize(person),
+            b'<Person name="A &amp; B"><address city="X" />'
+            b"<emails>a</emails><emails>b</emails>"
+            b'<addresses city="Y" /></Person>',
+        )
+
+    def test_slots(self):
+        class Item(object):
+            __slots__ = ("id", "label", "unset")
+
+            def __init__(self, id, label):
+                self.id = id
+                self.label = label
+
+        serializer = ObjectSerializer()
+        serializer.register(Item, tag="item", attributes=["id"], text="label")
+        self.assertEqual(
+            self.serialize(Item(1, "<x>"), serializer),
+            b'<item id="1">&lt;x&gt;</item>',
+        )
+        self.assertEqual(
+            self.serialize(Item(2, "y"), serializer, tag="other"),
+            b'<other id="2">y</other>',
+        )
+
+    @unittest.skipIf(not hasattr(typing, "TypedDict"), "requires TypedDict")
+    def test_typeddict(self):
+        Movie = typing.TypedDict("Movie", {"title": str, "year": int}, total=False)
+        self.assertEqual(
+            self.serialize({"title": "T"}, cls=Movie), b'<Movie title="T" />'
+        )
+
+    @unittest.skipIf(dataclasses is None, "requires dataclasses")
+    def test_unresolved_annotation(self):
+        Person = dataclasses.make_dataclass(
+            "Person", [("name", str), ("address", "Address")]
+        )
+        with self.assertRaises(TypeError) as cm:
+            self.serialize(Person("n", None))
+        self.assertIn("'address'", str(cm.exception))
+
+    def test_private_slots(self):
+        class Item(object):
+            __slots__ = ("__id", "label")
+
+            def __init__(self, id, label):
+                self.__id = id
+                self.label = label
+
+        serializer = ObjectSerializer()
+        serializer.register(Item)
+        self.assertEqual(
+            self.serialize(Item(1, "x"), serializer), b'<Item __id="1" label="x" />'
+        )
+
+    def test_unregistered_slots(self):
+        import uuid
+
+        class Item(object):
+            __slots__ = ("id",)
+
+        Record = typing.NamedTuple("Record", [("id", uuid.UUID), ("item", Item)])
+        item = Item()
+        item.id = 1
+        uid = uuid.UUID(int=5)
+        self.assertEqual(
+            self.serialize(Record(uid, None)),
+            b'<Record id="00000000-0000-0000-0000-000000000005" />',
+        )
+        self.assertRaises(TypeError, self.serialize, item)
+
+    def test_unsupported_type(self):
+        self.assertRaises(TypeError, self.serialize, object())
+
+
+class TestRows(XMLWriterTestCase):
+    columns = {
+        "id": list(range(2500)),
+        "name": ["a&b", None, '"c"', "d"] * 625,
+        "note": ["<x>", "y", None, ""] * 625,
+        "text": [None, "", "t", "u>"] * 625,
+    }
+
+    def by_row(self, **kwargs):
+        w = XMLWriter(BytesIO(), **kwargs)
+        w.start("table")
+        for n in range(2500):
+            attributes = {"id": str(n)}
+            if self.columns["name"][n] is not None:
+                attributes["name"] = self.columns["name"][n]
+            w.start("row", attributes)
+            if self.columns["text"][n] is not None:
+                w.data(self.columns["text"][n])
+            if self.columns["note"][n] is not None:
+                w.start("note")
+                w.data(self.columns["note"][n])
+                w.end()
+            w.end()
+        w.close()
+        return w.file.getvalue()
+
+    def test_same_as_row_by_row(self):
+        for kwargs in ({}, {"pretty_print": True}, {"abbrev_empty": False}):
+            w = XMLWriter(BytesIO(), **kwargs)
+            w.start("table")
+            w.rows("row", self.columns, children=["note"], text="text")
+            w.close()
+            self.assertOutput(w, self.by_row(**kwargs))
+
+    def test_sort_order(self):
+        w = XMLWriter(BytesIO(), sort={"row": ["b", "a"]})
+        w.rows("row", {"a": ["1"], "b": ["2"]})
+        self.assertOutput(w, b'<row b="2" a="1" />')
+
+    def test_namespaces(self):
+        w = XMLWriter(BytesIO())
+        w.rows("{http://example.org/ns}row", {"a": ["1", "2"]})
+        self.assertOutput(
+            w,
+            b'<ns2:row xmlns:ns2="http://example.org/ns" a="1" />'
+            b'<ns2:row xmlns:ns2="http://example.org/ns" a="2" />',
+        )
+
+    def test_no_rows(self):
+        w = XMLWriter(BytesIO())
+        w.start("table")
+        w.rows("row", {"a": []})
+        w.close()
+        self.assertOutput(w, b"<table />")
+
+    def test_length_mismatch(self):
+        w = XMLWriter(BytesIO())
+        self.assertRaises(ValueError, w.rows, "row", {"a": [1], "b": [1, 2]})
+
+    def test_numpy(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest("requires numpy")
+        columns = {
+            "a": numpy.array([1, 2]),
+            "b": numpy.array([0.5, 1.5], dtype=numpy.float32),
+            "c": numpy.array([True, False]),
+        }
+        for kwargs in ({}, {"debug": True}):
+            w = XMLWriter(BytesIO(), **kwargs)
+            w.rows("row", columns)
+            self.assertOutput(
+                w, b'<row a="1" b="0.5" c="true" /><row a="2" b="1.5" c="false" />'
+            )
+
+
+class TestTypedValues(XMLWriterTestCase):
+    values = {
+        "a": 1,
+        "b": 0.5,
+        "c": decimal.Decimal("1.10"),
+        "d": True,
+        "e": datetime.datetime(2020, 1, 2, 3, 4, 5),
+        "f": datetime.date(2020, 1, 2),
+        "g": None,
+    }
+
+    def test_attributes(self):
+        for trusted in (False, True):
+            w = XMLWriter(BytesIO(), trusted=trusted)
+            w.start("x", self.values)
+            w.close()
+            self.assertOutput(
+                w,
+                b'<x a="1" b="0.5" c="1.10" d="true"'
+                b' e="2020-01-02T03:04:05" f="2020-01-02" />',
+            )
+
+    def test_data(self):
+        w = XMLWriter(BytesIO())
+        w.start("x")
+        for value in (1, 0.5, False, None, datetime.time(12, 30)):
+            w.data(value)
+        w.close()
+        self.assertOutput(w, b"<x>10.5false12:30:00</x>")
+
+    def test_element_zero(self):
+        w = XMLWriter(BytesIO())
+        w.element("x", data=0)
+        self.assertOutput(w, b"<x>0</x>")
+
+    def test_formats(self):
+        w = XMLWriter(BytesIO(), float_format=".2f", date_format="<%Y>")
+        w.start("x", a=1.0, b=datetime.date(2020, 1, 2))
+        w.data(datetime.datetime(2021, 1, 1))
+        w.close()
+        self.assertOutput(w, b'<x a="1.00" b="&lt;2020>">&lt;2021&gt;</x>')
+
+    def test_float_format_escaped(self):
+        w = XMLWriter(BytesIO(), float_format="<<8")
+        w.start("x", b=1.5)
+        w.close()
+        self.assertOutput(w, b'<x b="1.5&lt;&lt;&lt;&lt;&lt;" />')
+
+    def test_debug_checks_formatted_attributes(self):
+        formatters = {bytes: lambda b: b.decode()}
+        w = XMLWriter(BytesIO(), formatters=formatters, debug=True)
+        self.assertRaises(XMLSyntaxError, w.start, "x", a=b"\x00")
+        w.start("x", a=b"ok", b=None)
+        w.close()
+        self.assertOutput(w, b'<x a="ok" />')
+
+    def test_formatters(self):
+        class Special(str):
+            pass
+
+        formatters = {bool: lambda v: "yes" if v else "<no>", Special: str.upper}
+        w = XMLWriter(BytesIO(), formatters=formatters)
+        w.start("x", a=True, b=False, c=Special("s&"))
+        w.data("plain&")
+        w.close()
+        self.assertOutput(w, b'<x a="yes" b="&lt;no>" c="S&amp;">plain&amp;</x>')
+
+    def test_formatters_for_base_classes(self):
+        formatters = {datetime.date: lambda d: d.strftime("%d.%m.%Y"), int: hex}
+        w = XMLWriter(BytesIO(), formatters=formatters)
+        w.start("x", a=datetime.datetime(2020, 1, 2, 3, 4), b=True)
+        w.data(datetime.date(2020, 1, 3))
+        w.close()
+        self.assertOutput(w, b'<x a="02.01.2020" b="0x1">03.01.2020</x>')
+
+    def test_formatters_read_only(self):
+        formatters = {int: hex}
+        config = WriterConfig(formatters=formatters)
+        formatters[int] = oct
+        with self.assertRaises(TypeError):
+            config.formatters[float] = str
+        w = XMLWriter(BytesIO(), config=config)
+        w.start("x", a=8)
+        w.close()
+        self.assertOutput(w, b'<x a="0x8" />')
+
+    def test_unknown_type(self):
+        from fractions import Fraction
+
+        w = XMLWriter(BytesIO())
+        w.start("x", a=Fraction(1, 3))
+        w.close()
+        self.assertOutput(w, b'<x a="1/3" />')
+
+    def test_rows(self):
+        w = XMLWriter(BytesIO())
+        w.rows(
+            "x", {"a": [1, 2.5, None], "b": [True, False, True]}, children=["b"]
+        )
+        self.assertOutput(
+            w,
+            b'<x a="1"><b>true</b></x><x a="2.5"><b>false</b></x><x><b>true</b></x>',
+        )
+
+
+class TestMultiSink(XMLWriterTestCase):
+    def write_document(self, file):
+        w = XMLWriter(file)
+        w.pi("pi", "data")
+        w.start("root")
+        for n in range(2000):
+            w.element("item", data="<%d>" % n, n=str(n))
+            w.comment("comment")
+        w.element("empty")
+        w.close()
+
+    def test_sinks(self):
+        import gzip
+        import hashlib
+
+        expected = BytesIO()
+        self.write_document(expected)
+        expected = expected.getvalue()
+        for threaded in (False, True):
+            raw, compressed = BytesIO(), BytesIO()
+            gzip_file = gzip.GzipFile(fileobj=compressed, mode="wb")
+            sha256, md5, counter = hashlib.sha256(), hashlib.md5(), OutputCounter()
+            sinks = [raw, gzip_file, sha256, md5, counter]
+            with MultiSink(sinks, buffer_size=1000, threaded=threaded) as sink:
+                self.write_document(sink)
+            gzip_file.close()
+            self.assertEqual(raw.getvalue(), expected)
+            self.assertEqual(gzip.decompress(compressed.getvalue()), expected)
+            self.assertEqual(sha256.digest(), hashlib.sha256(expected).digest())
+            self.assertEqual(md5.digest(), hashlib.md5(expected).digest())
+            self.assertEqual(counter.bytes, len(expected))
+            self.assertEqual(counter.elements, 2002)
+
+    def test_buffering(self):
+        out = BytesIO()
+        sink = MultiSink([out], buffer_size=10)
+        sink.write(b"12345")
+        self.assertEqual(out.getvalue(), b"")
+        sink.write(b"67890")
+        self.assertEqual(out.getvalue(), b"1234567890")
+        sink.write(b"x")
+        sink.close()
+        self.assertEqual(out.getvalue(), b"1234567890x")
+        self.assertRaises(ValueError, sink.write, b"y")
+
+    class Broken(object):
+        def write(self, data):
+            raise IOError("broken")
+
+    def test_thread_error(self):
+        out = BytesIO()
+        sink = MultiSink([out, self.Broken()], threaded=True)
+        sink.write(b"data")
+        self.assertRaises(IOError, sink.close)
+        self.assertEqual(out.getvalue(), b"data")
+
+    def test_thread_error_raised_early(self):
+        sink = MultiSink([self.Broken()], buffer_size=1, threaded=True)
+        sink.write(b"a")
+        sink._threads[0].join()
+        self.assertRaises(IOError, sink.write, b"b")
+        self.assertRaises(IOError, sink.close)
+
+    def test_sync_error_joins_threads(self):
+        out = BytesIO()
+        sink = MultiSink([out, self.Broken()], threaded=[out])
+        sink.write(b"data")
+        self.assertRaises(IOError, sink.close)
+        self.assertTrue(sink.closed)
+        self.assertFalse(sink._threads[0]._thread.is_alive())
+        self.assertEqual(out.getvalue(), b"data")
+
+
 class TestIterwrite(XMLWriterTestCase):
     def test_basic(self):
         from lxml import etree
@@ -337,6 +891,9 @@ class TestToString(XMLWriterTestCase):
         xml = tostring(elem)
         self.assertEqual(xml, b'<foo bar="baz">something</foo>whatnot')
 
+    def test_options(self):
+        self.assertEqual(tostring("foo", abbrev_empty=False), b"<foo></foo>")
+
 
 if __name__ == "__main__":
     unittest.main()